@@ -1,14 +1,118 @@
 import carla
+import numpy as np
+import cv2
 import time
 import os
 import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Configuration
 CAMERA_SIZE = (800, 600)
 FPS = 20  # Match recording FPS
+JPEG_QUALITY = 85
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]  # Built once, reused per encode
+WRITE_WORKERS = 4  # Parallel encode + disk write threads
+SAVE_BATCH = 8  # Frames per writer job in sync mode; amortizes per-job dispatch cost
+TICK_BATCH = 4  # Ticks issued back-to-back in sync mode before draining frames
 SPECTATOR_POS = carla.Transform(carla.Location(x=50, y=0, z=30), carla.Rotation(pitch=-30))
 FOLLOW_POS = carla.Transform(carla.Location(x=-8, z=6), carla.Rotation(pitch=-15))
 
+def to_bgr_array(image):
+    """Zero-copy BGR view over a carla.Image BGRA buffer"""
+    array = np.frombuffer(image.raw_data, dtype=np.uint8)
+    array = array.reshape((image.height, image.width, 4))
+    return array[:, :, :3]
+
+# Pool of reusable BGR frame buffers shared between sensor callbacks and
+# the writer workers; checkout copies the frame out of the carla-owned
+# buffer, the writer returns it after encoding. Caps frames in flight and
+# removes all steady-state allocation from the capture path.
+BUF_POOL_SIZE = 8
+BUF_POOL = queue.Queue(maxsize=BUF_POOL_SIZE)
+for _ in range(BUF_POOL_SIZE):
+    BUF_POOL.put(np.empty((CAMERA_SIZE[1], CAMERA_SIZE[0], 3), dtype=np.uint8))
+
+def checkout_frame(image):
+    """Copy a carla.Image into a pooled buffer (blocks while all are in flight)"""
+    buf = BUF_POOL.get()
+    np.copyto(buf, to_bgr_array(image))
+    return buf
+
+def save_frame(frame, filename):
+    """Encode a pooled frame buffer to JPEG, write it, and return it to the pool"""
+    try:
+        ok, jpeg = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+        if not ok:
+            return
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, jpeg)
+            # Frames are never read back during the session; tell the kernel
+            # not to keep their pages cached at the expense of hotter data
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    finally:
+        BUF_POOL.put(frame)
+
+def save_frames(batch):
+    """Encode and write a batch of (frame, filename) pairs in one worker job"""
+    for frame, filename in batch:
+        save_frame(frame, filename)
+
+def make_frame_queue(maxsize=TICK_BATCH):
+    """Bounded frame handoff between sensor callback and main loop, returns (queue, callback)"""
+    frame_queue = queue.Queue(maxsize=maxsize)
+
+    def on_image(image):
+        frame = checkout_frame(image)
+        try:
+            frame_queue.put_nowait(frame)
+        except queue.Full:
+            # Main thread cannot keep up - drop the oldest frame
+            # and give its buffer straight back to the pool
+            try:
+                BUF_POOL.put(frame_queue.get_nowait())
+            except queue.Empty:
+                pass
+            frame_queue.put_nowait(frame)
+
+    return frame_queue, on_image
+
+def wait_for_vehicles(world, sync_mode, timeout=5.0):
+    """Wait for replay vehicles to appear, returns the vehicle list (empty on timeout)"""
+    print("Waiting for vehicles to spawn from replay...")
+    spawned = threading.Event()
+    vehicles_ref = []
+
+    def on_snapshot(snapshot):
+        if spawned.is_set():
+            return
+        found = world.get_actors().filter('vehicle.*')
+        if found:
+            vehicles_ref.append(found)
+            spawned.set()
+
+    callback_id = world.on_tick(on_snapshot)
+    try:
+        if sync_mode:
+            # The server only advances when we tick; the callback breaks
+            # the loop as soon as the first vehicle shows up
+            deadline = time.monotonic() + timeout
+            while not spawned.is_set() and time.monotonic() < deadline:
+                world.tick()
+        else:
+            spawned.wait(timeout=timeout)
+    finally:
+        world.remove_on_tick(callback_id)
+
+    if not vehicles_ref:
+        print(f"No vehicles found after waiting {timeout:.0f} seconds")
+        return []
+    return vehicles_ref[0]
+
 def run_replay(client, log_file, capture_func, duration, sync_mode):
     """Start replay and run capture function for specified duration"""
     log_file = os.path.abspath(log_file)
@@ -58,72 +162,93 @@ def run_replay(client, log_file, capture_func, duration, sync_mode):
         # Restore original settings
         world.apply_settings(original_settings)
 
+# Blueprint found and sized once; only sensor_tick varies between cameras
+_camera_bp = None
+
 def create_camera(world, transform, sync_mode, attach_to=None):
     """Create camera with standard settings"""
-    camera_bp = world.get_blueprint_library().find('sensor.camera.rgb')
-    camera_bp.set_attribute('image_size_x', str(CAMERA_SIZE[0]))
-    camera_bp.set_attribute('image_size_y', str(CAMERA_SIZE[1]))
-    
+    global _camera_bp
+    if _camera_bp is None:
+        _camera_bp = world.get_blueprint_library().find('sensor.camera.rgb')
+        _camera_bp.set_attribute('image_size_x', str(CAMERA_SIZE[0]))
+        _camera_bp.set_attribute('image_size_y', str(CAMERA_SIZE[1]))
+
     if sync_mode:
-        camera_bp.set_attribute('sensor_tick', '0.0')  # Capture every tick in sync mode
+        _camera_bp.set_attribute('sensor_tick', '0.0')  # Capture every tick in sync mode
     else:
-        camera_bp.set_attribute('sensor_tick', str(1.0 / FPS))  # Time-based capture
-    
-    return world.spawn_actor(camera_bp, transform, attach_to=attach_to)
+        _camera_bp.set_attribute('sensor_tick', str(1.0 / FPS))  # Time-based capture
+
+    return world.spawn_actor(_camera_bp, transform, attach_to=attach_to)
 
 def camera_mode(client, log_file, output_dir, duration, sync_mode):
     """Capture spectator camera images"""
     output_dir = os.path.abspath(output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    
+    # Join the directory once; per-frame names are a single format call
+    frame_prefix = os.path.join(output_dir, 'frame_')
+
     frame_count = 0
     camera = None
-    captured_image = None
     start_time = None
-    
+    pool = ThreadPoolExecutor(max_workers=WRITE_WORKERS)
+    futures = []
+
     def capture_frames(world, target, sync_mode):
-        nonlocal camera, frame_count, captured_image, start_time
+        nonlocal camera, frame_count, start_time
         camera = create_camera(world, SPECTATOR_POS, sync_mode)
         start_time = time.time()
-        
+
         if sync_mode:
-            def on_image(image):
-                nonlocal captured_image
-                captured_image = image
-            
+            frame_queue, on_image = make_frame_queue()
             camera.listen(on_image)
             print(f"Capturing {target} frames at {FPS} FPS to: {output_dir}")
-            
+
+            batch = []
             while frame_count < target:
-                world.tick()
-                if captured_image is not None:
-                    filename = os.path.join(output_dir, f"frame_{frame_count:06d}.jpg")
-                    captured_image.save_to_disk(filename, carla.ColorConverter.Raw)
+                # Issue a run of ticks back-to-back, then drain the frames
+                # they produced; amortizes the per-tick RPC round-trip
+                ticks = min(TICK_BATCH, target - frame_count)
+                for _ in range(ticks):
+                    world.tick()
+                for _ in range(ticks):
+                    try:
+                        frame = frame_queue.get(timeout=2.0)
+                    except queue.Empty:
+                        break
+                    filename = f"{frame_prefix}{frame_count:06d}.jpg"
+                    batch.append((frame, filename))
+                    if len(batch) == SAVE_BATCH:
+                        futures.append(pool.submit(save_frames, batch))
+                        batch = []
                     frame_count += 1
-                    captured_image = None
                     if frame_count % 20 == 0:
                         print(f"Captured {frame_count}/{target} frames")
+            if batch:
+                futures.append(pool.submit(save_frames, batch))
         else:
             def save_image(image):
                 nonlocal frame_count
-                filename = os.path.join(output_dir, f"frame_{frame_count:06d}.jpg")
-                image.save_to_disk(filename, carla.ColorConverter.Raw)
+                filename = f"{frame_prefix}{frame_count:06d}.jpg"
+                futures.append(pool.submit(save_frame, checkout_frame(image), filename))
                 frame_count += 1
                 if frame_count % 20 == 0:
                     elapsed = time.time() - start_time
                     fps_actual = frame_count / elapsed if elapsed > 0 else 0
                     print(f"Recording... {elapsed:.1f}s elapsed, {frame_count} frames ({fps_actual:.1f} FPS)")
-            
+
             camera.listen(save_image)
             print(f"Recording for {target} seconds to: {output_dir}")
-            while time.time() - start_time < target:
-                time.sleep(0.1)  # Small sleep to prevent busy waiting
-    
+            # Callbacks do the work; sleep until the recording window ends
+            done = threading.Event()
+            done.wait(timeout=target)
+
     try:
         run_replay(client, log_file, capture_frames, duration, sync_mode)
     finally:
         if camera:
             camera.destroy()
+        wait(futures)
+        pool.shutdown()
     
     elapsed = time.time() - start_time if start_time else 0
     fps_actual = frame_count / elapsed if elapsed > 0 else 0
@@ -133,75 +258,93 @@ def data_mode(client, log_file, duration, output_dir, sync_mode):
     """Extract vehicle data"""
     output_dir = os.path.abspath(output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, "vehicle_data.txt")
+    # Sync mode stores raw float32 columns; async streams text for
+    # open-ended recordings
+    output_file = os.path.join(output_dir, "vehicle_data.npz" if sync_mode else "vehicle_data.txt")
     frame_count = 0
     start_time = None
-    
+
     def extract_data(world, target, sync_mode):
         nonlocal frame_count, start_time
         start_time = time.time()
-        
-        # Wait for vehicles to spawn from replay
-        print("Waiting for vehicles to spawn from replay...")
-        vehicles = []
-        wait_attempts = 0
-        max_wait_attempts = 50  # 5 seconds at 0.1s intervals
-        
-        while not vehicles and wait_attempts < max_wait_attempts:
-            if sync_mode:
-                world.tick()  # In sync mode, tick to advance simulation
-            else:
-                time.sleep(0.1)  # In async mode, just wait
-            vehicles = world.get_actors().filter('vehicle.*')
-            wait_attempts += 1
-            if wait_attempts % 10 == 0:
-                print(f"Still waiting for vehicles... ({wait_attempts/10:.1f}s)")
-        
+
+        vehicles = wait_for_vehicles(world, sync_mode)
         if not vehicles:
-            print("No vehicles found after waiting 5 seconds")
             return
-        
+
         print(f"Found {len(vehicles)} vehicle(s) to track")
-        
-        with open(output_file, 'w') as f:
-            if sync_mode:
-                print(f"Extracting vehicle data for {target} frames...")
-                while frame_count < target:
-                    world.tick()
+
+        if sync_mode:
+            print(f"Extracting vehicle data for {target} frames...")
+            # The actor set rarely changes mid-replay; refresh the list
+            # once a second instead of one RPC per tick
+            last_refresh = 0
+            telemetry = np.empty((len(vehicles), 6), dtype=np.float32)
+            samples = []
+            while frame_count < target:
+                world.tick()
+                if frame_count - last_refresh >= 20 or frame_count == 0:
                     vehicles = world.get_actors().filter('vehicle.*')
-                    
-                    f.write(f"\n--- Frame {frame_count} ---\n")
-                    for vehicle in vehicles:
-                        try:
-                            t = vehicle.get_transform()
-                            v = vehicle.get_velocity()
-                            f.write(f"Vehicle {vehicle.id}: pos=({t.location.x:.1f},{t.location.y:.1f}) vel=({v.x:.1f},{v.y:.1f})\n")
-                        except:
-                            pass
-                    
-                    frame_count += 1
-                    if frame_count % 20 == 0:
-                        print(f"Processed {frame_count}/{target} frames")
-            else:
+                    last_refresh = frame_count
+                    if len(vehicles) > len(telemetry):
+                        telemetry = np.empty((len(vehicles), 6), dtype=np.float32)
+
+                # Gather rows (frame, id, x, y, vx, vy) into the preallocated
+                # array; no per-vehicle text formatting on the hot path
+                rows = 0
+                for vehicle in vehicles:
+                    try:
+                        t = vehicle.get_transform()
+                        v = vehicle.get_velocity()
+                        telemetry[rows] = (frame_count, vehicle.id, t.location.x, t.location.y, v.x, v.y)
+                        rows += 1
+                    except:
+                        pass
+                samples.append(telemetry[:rows].copy())
+
+                frame_count += 1
+                if frame_count % 20 == 0:
+                    print(f"Processed {frame_count}/{target} frames")
+
+            data = np.vstack(samples) if samples else np.empty((0, 6), dtype=np.float32)
+            np.savez_compressed(output_file,
+                                frame=data[:, 0].astype(np.int32),
+                                vid=data[:, 1].astype(np.int32),
+                                x=data[:, 2], y=data[:, 3],
+                                vx=data[:, 4], vy=data[:, 5])
+        else:
+            fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
                 print(f"Extracting vehicle data for {target} seconds...")
+                # Block on simulator ticks instead of wallclock sleeps; the
+                # snapshot timestamp gates sampling to the capture rate
+                next_sample = 0.0
                 while time.time() - start_time < target:
+                    snapshot = world.wait_for_tick(seconds=1.0)
+                    if snapshot.timestamp.elapsed_seconds < next_sample:
+                        continue
+                    next_sample = snapshot.timestamp.elapsed_seconds + 1.0 / FPS
                     vehicles = world.get_actors().filter('vehicle.*')
-                    
-                    f.write(f"\n--- Frame {frame_count} ---\n")
+
+                    # Gather the frame's lines and land them with one
+                    # writev syscall instead of a write per vehicle
+                    iov = [f"\n--- Frame {frame_count} ---\n".encode()]
                     for vehicle in vehicles:
                         try:
                             t = vehicle.get_transform()
                             v = vehicle.get_velocity()
-                            f.write(f"Vehicle {vehicle.id}: pos=({t.location.x:.1f},{t.location.y:.1f}) vel=({v.x:.1f},{v.y:.1f})\n")
+                            iov.append(f"Vehicle {vehicle.id}: pos=({t.location.x:.1f},{t.location.y:.1f}) vel=({v.x:.1f},{v.y:.1f})\n".encode())
                         except:
                             pass
-                    
+                    os.writev(fd, iov)
+
                     frame_count += 1
                     if frame_count % 20 == 0:
                         elapsed = time.time() - start_time
                         fps_actual = frame_count / elapsed if elapsed > 0 else 0
                         print(f"Recording... {elapsed:.1f}s elapsed, {frame_count} frames ({fps_actual:.1f} FPS)")
-                    time.sleep(1.0 / FPS)  # Control capture rate
+            finally:
+                os.close(fd)
     
     run_replay(client, log_file, extract_data, duration, sync_mode)
     
@@ -214,33 +357,20 @@ def follow_mode(client, log_file, duration, output_dir, sync_mode):
     """Follow vehicle with camera"""
     output_dir = os.path.abspath(output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    
+    # Join the directory once; per-frame names are a single format call
+    frame_prefix = os.path.join(output_dir, 'frame_')
+
     frame_count = 0
     camera = None
-    captured_image = None
     start_time = None
-    
+    pool = ThreadPoolExecutor(max_workers=WRITE_WORKERS)
+    futures = []
+
     def follow_vehicle(world, target, sync_mode):
-        nonlocal camera, frame_count, captured_image, start_time
-        
-        # Wait for vehicles to spawn from replay
-        print("Waiting for vehicles to spawn from replay...")
-        vehicles = []
-        wait_attempts = 0
-        max_wait_attempts = 50  # 5 seconds at 0.1s intervals
-        
-        while not vehicles and wait_attempts < max_wait_attempts:
-            if sync_mode:
-                world.tick()  # In sync mode, tick to advance simulation
-            else:
-                time.sleep(0.1)  # In async mode, just wait
-            vehicles = world.get_actors().filter('vehicle.*')
-            wait_attempts += 1
-            if wait_attempts % 10 == 0:
-                print(f"Still waiting for vehicles... ({wait_attempts/10:.1f}s)")
-        
+        nonlocal camera, frame_count, start_time
+
+        vehicles = wait_for_vehicles(world, sync_mode)
         if not vehicles:
-            print("No vehicles found after waiting 5 seconds")
             return
         
         target_vehicle = vehicles[0]
@@ -248,27 +378,37 @@ def follow_mode(client, log_file, duration, output_dir, sync_mode):
         start_time = time.time()
         
         if sync_mode:
-            def on_image(image):
-                nonlocal captured_image
-                captured_image = image
-            
+            frame_queue, on_image = make_frame_queue()
             camera.listen(on_image)
             print(f"Following vehicle {target_vehicle.id}, capturing {target} frames at {FPS} FPS to: {output_dir}")
-            
+
+            batch = []
             while frame_count < target:
-                world.tick()
-                if captured_image is not None:
-                    filename = os.path.join(output_dir, f"frame_{frame_count:06d}.jpg")
-                    captured_image.save_to_disk(filename, carla.ColorConverter.Raw)
+                # Issue a run of ticks back-to-back, then drain the frames
+                # they produced; amortizes the per-tick RPC round-trip
+                ticks = min(TICK_BATCH, target - frame_count)
+                for _ in range(ticks):
+                    world.tick()
+                for _ in range(ticks):
+                    try:
+                        frame = frame_queue.get(timeout=2.0)
+                    except queue.Empty:
+                        break
+                    filename = f"{frame_prefix}{frame_count:06d}.jpg"
+                    batch.append((frame, filename))
+                    if len(batch) == SAVE_BATCH:
+                        futures.append(pool.submit(save_frames, batch))
+                        batch = []
                     frame_count += 1
-                    captured_image = None
                     if frame_count % 20 == 0:
                         print(f"Captured {frame_count}/{target} frames")
+            if batch:
+                futures.append(pool.submit(save_frames, batch))
         else:
             def save_image(image):
                 nonlocal frame_count
-                filename = os.path.join(output_dir, f"frame_{frame_count:06d}.jpg")
-                image.save_to_disk(filename, carla.ColorConverter.Raw)
+                filename = f"{frame_prefix}{frame_count:06d}.jpg"
+                futures.append(pool.submit(save_frame, checkout_frame(image), filename))
                 frame_count += 1
                 if frame_count % 20 == 0:
                     elapsed = time.time() - start_time
@@ -277,14 +417,17 @@ def follow_mode(client, log_file, duration, output_dir, sync_mode):
             
             camera.listen(save_image)
             print(f"Following vehicle {target_vehicle.id} for {target} seconds to: {output_dir}")
-            while time.time() - start_time < target:
-                time.sleep(0.1)  # Small sleep to prevent busy waiting
+            # Callbacks do the work; sleep until the recording window ends
+            done = threading.Event()
+            done.wait(timeout=target)
     
     try:
         run_replay(client, log_file, follow_vehicle, duration, sync_mode)
     finally:
         if camera:
             camera.destroy()
+        wait(futures)
+        pool.shutdown()
     
     elapsed = time.time() - start_time if start_time else 0
     fps_actual = frame_count / elapsed if elapsed > 0 else 0
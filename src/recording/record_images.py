@@ -1,22 +1,61 @@
 import carla
+import numpy as np
+import cv2
 import time
 import os
+import queue
+import threading
+import subprocess
 
 # === CONFIG ===
-SAVE_DIR = 'output_images'
+VIDEO_FILE = 'carla_output.mp4'
 RECORD_TIME = 5  # seconds
 FPS = 20
+CAMERA_SIZE = (800, 600)
+JPEG_QUALITY = 85
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]  # Built once, reused per encode
+BITRATE = '5M'
+TICK_BATCH = 4  # Ticks issued back-to-back in sync mode before draining frames
 SYNCHRONOUS_MODE = True  # True = exact frame count, False = real-time performance
 
+def to_bgr_array(image):
+    """Zero-copy BGR view over a carla.Image BGRA buffer"""
+    array = np.frombuffer(image.raw_data, dtype=np.uint8)
+    array = array.reshape((image.height, image.width, 4))
+    return array[:, :, :3]
+
+def start_ffmpeg():
+    """Spawn ffmpeg reading a JPEG stream on stdin and encoding to H.264"""
+    cmd = [
+        'ffmpeg', '-y',
+        '-f', 'image2pipe',
+        '-framerate', str(FPS),
+        '-i', '-',
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-pix_fmt', 'yuv420p',
+        '-b:v', BITRATE,
+        VIDEO_FILE
+    ]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=0)
+
+def pipe_frame(proc, image):
+    """JPEG-encode a frame and stream it into ffmpeg's stdin"""
+    # Encoding here drops pipe traffic from ~1.9 MB raw BGRA to ~100 KB
+    # per frame; libjpeg-turbo keeps the encode well under a tick budget
+    ok, jpeg = cv2.imencode('.jpg', to_bgr_array(image), JPEG_PARAMS)
+    if ok:
+        proc.stdin.write(jpeg.tobytes())
+
 def main():
     # Connect to CARLA
     client = carla.Client('localhost', 2000)
     client.set_timeout(10.0)
     world = client.load_world('Town03')
-    
+
     # Store original settings
     original_settings = world.get_settings()
-    
+
     if SYNCHRONOUS_MODE:
         # Set synchronous mode for exact frame control
         settings = world.get_settings()
@@ -30,82 +69,101 @@ def main():
         settings.synchronous_mode = False
         world.apply_settings(settings)
         print(f"Using ASYNCHRONOUS mode - {RECORD_TIME} seconds real-time")
-    
+
     # Spawn vehicle and camera
     blueprint_library = world.get_blueprint_library()
     vehicle = world.spawn_actor(
         blueprint_library.filter('vehicle.tesla.model3')[0],
         world.get_map().get_spawn_points()[0]
     )
-    
+
     camera_bp = blueprint_library.find('sensor.camera.rgb')
-    camera_bp.set_attribute('image_size_x', '800')
-    camera_bp.set_attribute('image_size_y', '600')
-    
+    camera_bp.set_attribute('image_size_x', str(CAMERA_SIZE[0]))
+    camera_bp.set_attribute('image_size_y', str(CAMERA_SIZE[1]))
+
     if SYNCHRONOUS_MODE:
         camera_bp.set_attribute('sensor_tick', '0.0')  # Capture every tick
     else:
         camera_bp.set_attribute('sensor_tick', str(1.0 / FPS))  # Time-based capture
-    
+
     camera = world.spawn_actor(
-        camera_bp, 
-        carla.Transform(carla.Location(x=1.5, z=2.4)), 
+        camera_bp,
+        carla.Transform(carla.Location(x=1.5, z=2.4)),
         attach_to=vehicle
     )
-    
-    # Setup recording
-    os.makedirs(SAVE_DIR, exist_ok=True)
+
+    # Frames go straight into ffmpeg's stdin - no intermediate files on disk
+    proc = start_ffmpeg()
     frame_count = 0
-    captured_image = None
-    
+
+    # Bounded producer/consumer handoff between sensor callback and main loop
+    frame_queue = queue.Queue(maxsize=TICK_BATCH)
+
     def save_image(image):
-        nonlocal captured_image, frame_count
+        nonlocal frame_count
         if SYNCHRONOUS_MODE:
-            captured_image = image
+            try:
+                frame_queue.put_nowait(image)
+            except queue.Full:
+                # Main thread cannot keep up - drop the oldest frame
+                try:
+                    frame_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                frame_queue.put_nowait(image)
         else:
-            # Save immediately in async mode
-            filename = os.path.join(SAVE_DIR, f"frame_{frame_count:06d}.jpg")
-            image.save_to_disk(filename, carla.ColorConverter.Raw)
+            # Pipe the frame in async mode (callbacks arrive in order)
+            pipe_frame(proc, image)
             frame_count += 1
             if frame_count % 20 == 0:
-                print(f"Captured {frame_count} frames")
-    
+                elapsed = time.time() - start_time
+                fps_actual = frame_count / elapsed if elapsed > 0 else 0
+                print(f"Recording... {elapsed:.1f}s elapsed, {frame_count} frames ({fps_actual:.1f} FPS)")
+
+    start_time = time.time()
     camera.listen(save_image)
     vehicle.set_autopilot(True)
-    
+
     if SYNCHRONOUS_MODE:
         # Synchronous recording - exact frame count
         target_frames = RECORD_TIME * FPS
         print(f"Recording {target_frames} frames...")
-        
+
         while frame_count < target_frames:
-            world.tick()
-            if captured_image is not None:
-                filename = os.path.join(SAVE_DIR, f"frame_{frame_count:06d}.jpg")
-                captured_image.save_to_disk(filename, carla.ColorConverter.Raw)
+            # Issue a run of ticks back-to-back, then drain the frames
+            # they produced; amortizes the per-tick RPC round-trip
+            ticks = min(TICK_BATCH, target_frames - frame_count)
+            for _ in range(ticks):
+                world.tick()
+            for _ in range(ticks):
+                try:
+                    image = frame_queue.get(timeout=2.0)
+                except queue.Empty:
+                    break
+                pipe_frame(proc, image)
                 frame_count += 1
-                captured_image = None
                 if frame_count % 20 == 0:
                     print(f"Captured {frame_count}/{target_frames} frames")
     else:
-        # Asynchronous recording - time-based
+        # Asynchronous recording - time-based; callbacks do the work,
+        # the main thread just sleeps until the recording window ends
         print(f"Recording for {RECORD_TIME} seconds...")
-        start_time = time.time()
-        
-        while time.time() - start_time < RECORD_TIME:
-            time.sleep(0.1)  # Small sleep to prevent busy waiting
-            if frame_count > 0 and frame_count % 20 == 0:
-                elapsed = time.time() - start_time
-                fps_actual = frame_count / elapsed if elapsed > 0 else 0
-                print(f"Recording... {elapsed:.1f}s elapsed, {frame_count} frames ({fps_actual:.1f} FPS)")
-    
-    print(f"Recording completed. {frame_count} frames saved.")
-    
-    # Cleanup
+        done = threading.Event()
+        done.wait(timeout=RECORD_TIME)
+
+    # Stop the camera before closing the pipe so no callback writes to a closed stdin
     camera.stop()
+
+    # Flush remaining frames and let ffmpeg finalize the video
+    proc.stdin.close()
+    proc.wait()
+
+    print(f"Recording completed. {frame_count} frames encoded to {VIDEO_FILE}.")
+
+    # Cleanup
     camera.destroy()
     vehicle.destroy()
-    
+
     # Restore original settings
     world.apply_settings(original_settings)
 
@@ -37,9 +37,27 @@ def record_log(client, world, duration=10, log_filename="recording.log"):
     
     # Record for specified duration
     print(f"Recording for {duration} seconds...")
-    for i in range(duration):
-        time.sleep(1)
-        print(f"Recording... {i+1}/{duration} seconds")
+    settings = world.get_settings()
+    if settings.synchronous_mode:
+        # Drive the clock ourselves - exact simulated duration
+        delta = settings.fixed_delta_seconds or 0.05
+        total_ticks = int(duration / delta)
+        report_every = max(1, int(1.0 / delta))
+        for i in range(total_ticks):
+            world.tick()
+            if (i + 1) % report_every == 0:
+                print(f"Recording... {int((i + 1) * delta)}/{duration} seconds")
+    else:
+        # Follow the server clock instead of sleeping in 1s steps, which
+        # overshot the stop time by 0.5s on average
+        end = time.monotonic() + duration
+        last_report = 0
+        while time.monotonic() < end:
+            world.wait_for_tick(seconds=1.0)
+            elapsed = int(duration - (end - time.monotonic()))
+            if elapsed > last_report:
+                last_report = elapsed
+                print(f"Recording... {elapsed}/{duration} seconds")
     
     # Stop recording - let CARLA handle vehicle cleanup
     print("Stopping recorder...")
@@ -1,6 +1,5 @@
 import os
 import subprocess
-import glob
 
 # === CONFIG ===
 SAVE_DIR = 'output_images'       # Same directory used by CARLA script
@@ -13,23 +12,30 @@ def create_video():
         print(f"Directory {SAVE_DIR} does not exist.")
         return False
 
-    # Check if we have image files
-    image_pattern = os.path.join(SAVE_DIR, 'frame_*.jpg')
-    image_files = glob.glob(image_pattern)
-    
-    if not image_files:
+    # Check that at least one frame exists without materializing the full
+    # file list; ffmpeg enumerates the sequence itself via the input pattern
+    with os.scandir(SAVE_DIR) as entries:
+        has_frames = any(e.name.startswith('frame_') and e.name.endswith('.jpg') for e in entries)
+
+    if not has_frames:
         print(f"No image files found in {SAVE_DIR}")
         return False
-    
-    print(f"Found {len(image_files)} images. Creating video...")
 
-    # Basic ffmpeg command compatible with most installations
+    print("Creating video...")
+
+    # Explicit codec and preset; the x264 default preset 'medium' is
+    # 5-10x slower than ultrafast for this one-shot encode
     cmd = [
         'ffmpeg', '-y',                    # Overwrite output file
         '-framerate', str(FPS),            # Input framerate
         '-i', os.path.join(SAVE_DIR, 'frame_%06d.jpg'),  # Input pattern
+        '-c:v', 'libx264',                 # H.264 encode
+        '-preset', 'ultrafast',            # Throughput over compression ratio
+        '-tune', 'stillimage',             # Input is a JPEG sequence
+        '-pix_fmt', 'yuv420p',             # Broad player compatibility
         '-b:v', BITRATE,                   # Video bitrate
         '-r', str(FPS),                    # Output framerate
+        '-threads', '0',                   # Let ffmpeg use all cores
         VIDEO_FILE
     ]
 